@@ -1,10 +1,12 @@
 import argparse
 import logging
+import operator
 import os
-from glob import glob
+from pathlib import Path
+from statistics import fmean, pstdev
 
 import numpy as np
-from run_prompts import read_json, write_json
+from run_prompts import natural_keys, read_json, write_json
 from tqdm import tqdm
 
 logging.basicConfig(
@@ -19,20 +21,17 @@ def compute_our_rouge(reference: str, pred: str) -> float:
 
     Args
     ----
-    reference: reference text
-    pred: predicition text, e.g. generated by an Language Model
+    reference: lowercased reference text
+    pred: lowercased predicition text, e.g. generated by an Language Model
 
     Returns
     ----
     score: rouge score [0, 1]
 
     """
-    assert isinstance(reference, str) and isinstance(pred, str)
-
-    reference = reference.lower()
-    pred = [word.lower() for word in pred.split()]
+    pred_tokens = set(pred.split())
 
-    if reference in pred:
+    if reference in pred_tokens:
         score = 1
     else:
         score = 0
@@ -43,35 +42,126 @@ def compute_our_rouge(reference: str, pred: str) -> float:
 def compute_our_bleu(reference: str, pred: str) -> float:
     """Compute our bleu score for only Unigrams
 
+    Args
+    ----
+    reference: lowercased reference text
+    pred: lowercased predicition text, e.g. generated by an Language Model
+
+    Returns
+    ----
+    score: bleu score [0, 1]
+
+    """
+    preds = pred.split()
+    denom = len(preds)
+    nom = preds.count(reference)
+    if denom == 0:
+        score = 0
+    else:
+        score = nom / denom
+    return score
+
+
+def compute_nihed_score(reference: str, pred: str, prompt: str) -> float:
+    """Compute Nihed's score for one prediction.
+
     Args
     ----
     reference: reference text
     pred: predicition text, e.g. generated by an Language Model
+    prompt: prompt text that was given to the Language Model
 
     Returns
     ----
-    score: bleu score [0, 1]
+    score: nihed score [-0.33, 0.99]
 
     """
-    assert isinstance(reference, str) and isinstance(pred, str)
+    score = 0
 
-    reference = reference.lower()
-    preds = [word.lower() for word in pred.split()]
-    denom = len(preds)
-    nom = 0
-    for pred in preds:
+    # The prompt tokens only matter once the answer is found, so check it first.
+    if reference in pred:
+        prompt_split = prompt.split()
+
+        if prompt_split[-2] not in pred:
+            score += 0.33
+
+        elif prompt_split[-1] not in pred:
+            score += 0.66
 
-        if pred == reference:
-            nom += 1
         else:
-            nom += 0
-    if denom == 0:
+            score += 0.99
+
+    elif "where" in pred:
+        score -= 0.33
+
+    elif "?" in pred:
+        # ("not sure" in pred)
         score = 0
+
+    elif "Answer not in context" in pred:
+        score += 0.99
+
     else:
-        score = nom / denom
+        score = 0
+
     return score
 
 
+def load_results(path: str, heuristics: bool) -> dict:
+    """Load the predictions, correct answers, and prompts of a json results file.
+
+    Args
+    ----
+    path: path to the json results file
+    heuristics: whether to take the predictions of the hand-crafted heuristics
+
+    Returns
+    -------
+    splits: {"val": (predictions, correct_answers, prompt_text), "test": ...}
+
+    """
+    data = read_json(path)
+    splits = {}
+    for split in ["val", "test"]:
+        if heuristics:
+            predictions = [sample["prediction_hand_crafted"] for sample in data[split]]
+            predictions = [pred if pred is not None else "" for pred in predictions]
+            correct_answers = [sample["correct_answer"] for sample in data[split]]
+            prompt_text = ["" for sample in data[split]]
+        else:
+            predictions = [sample["prediction"] for sample in data[split]]
+            correct_answers = [sample["correct_answer"] for sample in data[split]]
+            prompt_text = [sample["prompt_text"] for sample in data[split]]
+
+        splits[split] = (predictions, correct_answers, prompt_text)
+
+    return splits
+
+
+def evaluate_results(splits: dict, metric: str) -> dict:
+    """Evaluate the val and test splits of one results file.
+
+    Args
+    ----
+    splits: the output of `load_results`
+    metric: evaluation metric (e.g., "global_accuracy")
+
+    Returns
+    -------
+    evaluation: {"val": score, "test": score}
+
+    """
+    metric = metric.lower()
+    evaluation = {}
+    for split, (predictions, correct_answers, prompt_text) in splits.items():
+        score = evaluate(predictions, correct_answers, metric, prompt_text)
+        if metric == "global_accuracy":
+            score = round(score, 4)
+        evaluation[split] = score
+
+    return evaluation
+
+
 def evaluate_wrapper(
     results_path: str,
     metrics: list = ["bleu", "f1", "nihed", "rouge", "global_accuracy"],
@@ -88,10 +178,14 @@ def evaluate_wrapper(
     else:
         heuristics = False
 
-    paths = glob(os.path.join(results_path, "*.json"))
-    from run_prompts import natural_keys
-
-    paths.sort(key=natural_keys)
+    paths = sorted(
+        (
+            entry.path
+            for entry in os.scandir(results_path)
+            if entry.name.endswith(".json") and not entry.name.startswith(".")
+        ),
+        key=natural_keys,
+    )
     logging.info(f"Running evaluation on {paths} ...")
     if heuristics:
         save_path_dir = results_path.replace("data", "evaluation")
@@ -100,70 +194,27 @@ def evaluate_wrapper(
         save_path_dir = results_path.replace("results", "evaluation")
     os.makedirs(save_path_dir, exist_ok=True)
 
+    # Every metric is computed on the same files, so parse each of them only once.
+    results = {Path(path).stem: load_results(path, heuristics) for path in paths}
+
     for metric in tqdm(metrics):
         if metric.lower() == "nihed" and heuristics:
             continue
         logging.info(f"Running {metric} metric on {paths} ...")
-        evaluation = {}
-        for path in tqdm(paths):
-
-            item = os.path.basename(path).split(".json")[0]
-            evaluation[item] = {}
-            data = read_json(path)
-
-            for split in ["val", "test"]:
-                if heuristics:
-                    predictions = [
-                        sample["prediction_hand_crafted"] for sample in data[split]
-                    ]
-                    predictions = [
-                        pred if pred is not None else "" for pred in predictions
-                    ]
-                    correct_answers = [
-                        sample["correct_answer"] for sample in data[split]
-                    ]
-                    prompt_text = ["" for sample in data[split]]
-                else:
-                    predictions = [sample["prediction"] for sample in data[split]]
-                    correct_answers = [
-                        sample["correct_answer"] for sample in data[split]
-                    ]
-                    prompt_text = [sample["prompt_text"] for sample in data[split]]
-
-                if metric.lower() == "global_accuracy":
-                    global_accuracy = evaluate(
-                        predictions, correct_answers, metric=metric.lower()
-                    )
-                    evaluation[item][split] = round(global_accuracy, 4)
-
-                elif metric.lower() == "bleu":
-                    bleu_score = evaluate(
-                        predictions, correct_answers, metric=metric.lower()
-                    )
-                    evaluation[item][split] = bleu_score
-
-                elif metric.lower() == "rouge":
-                    rouge_score = evaluate(
-                        predictions, correct_answers, metric=metric.lower()
-                    )
-                    evaluation[item][split] = rouge_score
-
-                elif metric.lower() == "f1":
-                    f1_score = evaluate(
-                        predictions, correct_answers, metric=metric.lower()
-                    )
-                    evaluation[item][split] = f1_score
-
-                elif metric.lower() == "nihed":
-                    nihed_score = evaluate(
-                        predictions, correct_answers, metric.lower(), prompt_text
-                    )
-                    evaluation[item][split] = nihed_score
-
-        val_mean = float(np.mean([item["val"] for item in evaluation.values()]))
-        val_std = float(np.std([item["val"] for item in evaluation.values()]))
-        test_mean = float(np.mean([item["test"] for item in evaluation.values()]))
-        test_std = float(np.std([item["test"] for item in evaluation.values()]))
+        evaluation = {
+            item: evaluate_results(splits, metric)
+            for item, splits in tqdm(results.items())
+        }
+
+        vals = [item["val"] for item in evaluation.values()]
+        tests = [item["test"] for item in evaluation.values()]
+
+        if evaluation:
+            val_mean, val_std = fmean(vals), pstdev(vals)
+            test_mean, test_std = fmean(tests), pstdev(tests)
+        else:
+            # fmean and pstdev raise on empty input; keep np.mean's NaN summaries.
+            val_mean = val_std = test_mean = test_std = float("nan")
 
         evaluation["val_mean"] = round(val_mean, 4)
         evaluation["val_std"] = round(val_std, 4)
@@ -186,15 +237,17 @@ def evaluate(
     correct_answers: A list of correct answers. Every element is the correct location
         of the query object.
     """
-    if metric.lower() == "global_accuracy":
+    metric = metric.lower()
+    assert len(correct_answers) == len(predictions)
 
-        T = 0
-        F = 0
-        for answer, pred in zip(correct_answers, predictions):
-            if answer in pred:
-                T += 1
-            else:
-                F += 1
+    if metric in ["bleu", "rouge", "f1"]:
+        # These metrics are case-insensitive, so lowercase the texts only once.
+        predictions = [pred.lower() for pred in predictions]
+        correct_answers = [answer.lower() for answer in correct_answers]
+
+    if metric == "global_accuracy":
+        T = sum(map(operator.contains, predictions, correct_answers))
+        F = len(predictions) - T
 
         global_acc = T / (T + F)
         logging.info(f"T: {T}, F: {F}")
@@ -203,91 +256,58 @@ def evaluate(
         # should this be commented
         return global_acc
 
-    if metric.lower() == "bleu":
-        bleu_all = []
-        for answer, pred in zip(correct_answers, predictions):
-            bleu = compute_our_bleu(answer, pred)
-            print(bleu, answer, pred)
-            bleu_all.append(bleu)
+    if metric == "bleu":
+        bleu_all = np.fromiter(
+            map(compute_our_bleu, correct_answers, predictions),
+            dtype=float,
+            count=len(predictions),
+        )
 
-        return float(np.mean(bleu_all))
+        return float(bleu_all.mean())
 
-    if metric.lower() == "rouge":
-        rouge_all = []
-        for answer, pred in zip(correct_answers, predictions):
-            rouge = compute_our_rouge(answer, pred)
-            rouge_all.append(rouge)
-            print(rouge, answer, pred)
+    if metric == "rouge":
+        rouge_all = np.fromiter(
+            map(compute_our_rouge, correct_answers, predictions),
+            dtype=float,
+            count=len(predictions),
+        )
 
-        return float(np.mean(rouge_all))
+        return float(rouge_all.mean())
 
-    if metric.lower() == "f1":
+    if metric == "f1":
         bleu_all = []
+        rouge_all = []
         for answer, pred in zip(correct_answers, predictions):
-            bleu = compute_our_bleu(answer, pred)
-            print(bleu, answer, pred)
-            bleu_all.append(bleu)
+            bleu_all.append(compute_our_bleu(answer, pred))
+            rouge_all.append(compute_our_rouge(answer, pred))
 
+        # np.mean's pairwise summation keeps the stored f1 scores reproducible.
         bleu_avg = float(np.mean(bleu_all))
-
-        rouge_all = []
-        for answer, pred in zip(correct_answers, predictions):
-            rouge = compute_our_rouge(answer, pred)
-            rouge_all.append(rouge)
-            print(rouge, answer, pred)
         rouge_avg = float(np.mean(rouge_all))
 
         if bleu_avg + rouge_avg == 0:
             f1 = 0
         else:
             f1 = 2 * (bleu_avg * rouge_avg) / (bleu_avg + rouge_avg)
-        print(f1)
 
         return f1
 
-    if metric.lower() == "nihed":
-        scores = []
-        assert len(correct_answers) == len(predictions) == len(prompt_text)
-        for answer, pred, prompt in zip(correct_answers, predictions, prompt_text):
-            score = 0
-            prompt_split = prompt.split()
-
-            if (
-                (prompt_split[-2] in pred)
-                and (prompt_split[-1] in pred)
-                and (answer in pred)
-            ):
-                score += 0.99
-                scores.append(score)
-
-            elif (prompt_split[-2] in pred) and (answer in pred):
-                score += 0.66
-                scores.append(score)
-
-            elif answer in pred:
-                score += 0.33
-                scores.append(score)
-
-            elif "where" in pred:
-                score -= 0.33
-                scores.append(score)
-
-            elif "?" in pred:
-                # ("not sure" in pred)
-                score = 0
-                scores.append(score)
-
-            elif "Answer not in context" in pred:
-                score += 0.99
-                scores.append(score)
-
-            else:
-                score = 0
-                scores.append(score)
-
-        print(scores)
-
-        return float(np.mean(scores))
+    if metric == "nihed":
+        assert len(prompt_text) == len(predictions)
+        scores = np.fromiter(
+            (
+                compute_nihed_score(answer, pred, prompt)
+                for answer, pred, prompt in zip(
+                    correct_answers, predictions, prompt_text
+                )
+            ),
+            dtype=float,
+            count=len(predictions),
+        )
+
+        logging.debug("nihed scores: %s", scores)
+
+        return float(scores.mean())
 
     raise ValueError(f"the given metric {metric} is not right")
 